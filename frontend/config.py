@@ -1,20 +1,39 @@
 import os
+from dataclasses import dataclass
 from dotenv import load_dotenv # type: ignore
 
-# Load environment variables from .env
-load_dotenv()
+# Load environment variables from .env for local runs. K_SERVICE is always set
+# by Cloud Run, where the environment is injected by the platform.
+if os.getenv("K_SERVICE") is None:
+  load_dotenv()
 
-# GCP and Cloud Run settings
-PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
-LOCATION = os.getenv("CLOUD_RUN_REGION", "us-central1")
-JOB_NAME = os.getenv("DOWNLOAD_JOB_NAME", "dataset-downloader")
 
-# Full resource name for the job
-JOB_RESOURCE = f"projects/{PROJECT_ID}/locations/{LOCATION}/jobs/{JOB_NAME}"
+@dataclass(frozen=True, slots=True)
+class Config:
+  """Immutable snapshot of the frontend settings, read once at import."""
+  # GCP and Cloud Run settings
+  project_id: str | None
+  location: str
+  job_name: str
+  # Full resource name for the job
+  job_resource: str
+  # Service account email for OIDC token
+  service_account: str | None
+  # Flask settings
+  flask_host: str
+  flask_port: int
 
-# Service account email for OIDC token
-SERVICE_ACCOUNT = os.getenv("SERVICE_ACCOUNT_EMAIL")
 
-# Flask settings
-FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
-FLASK_PORT = int(os.getenv("PORT", 8080))
\ No newline at end of file
+_project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
+_location = os.getenv("CLOUD_RUN_REGION", "us-central1")
+_job_name = os.getenv("DOWNLOAD_JOB_NAME", "dataset-downloader")
+
+CFG = Config(
+  project_id=_project_id,
+  location=_location,
+  job_name=_job_name,
+  job_resource=f"projects/{_project_id}/locations/{_location}/jobs/{_job_name}",
+  service_account=os.getenv("SERVICE_ACCOUNT_EMAIL"),
+  flask_host=os.getenv("FLASK_HOST", "0.0.0.0"),
+  flask_port=int(os.getenv("PORT", 8080)),
+)
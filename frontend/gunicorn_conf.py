@@ -0,0 +1,9 @@
+import os
+
+# Each /enqueue request mostly waits on the Cloud Run Jobs API, so threads
+# rather than processes provide the concurrency.
+bind = f":{os.getenv('PORT', '8080')}"
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+timeout = 60
@@ -5,7 +5,7 @@ from google.cloud.run_v2.services.jobs import JobsClient # type: ignore
 from google.cloud.run_v2.types import RunJobRequest # type: ignore
 from google.api_core.exceptions import GoogleAPICallError, RetryError # type: ignore
 
-from frontend.config import JOB_RESOURCE
+from frontend.config import CFG
 from util.status import Status
 
 # Configure logging
@@ -15,6 +15,10 @@ logging.basicConfig(level=logging.INFO)
 # Initialize Jobs client
 _jobs_client = JobsClient()
 
+# Upper bound, in seconds, on how long a request thread waits for the
+# RunJob RPC to start the execution.
+RUN_JOB_TIMEOUT = 30.0
+
 
 def trigger_download_job(
   dataset: str,
@@ -35,12 +39,12 @@ def trigger_download_job(
   }
 
   request = RunJobRequest(
-    name=JOB_RESOURCE,
+    name=CFG.job_resource,
     overrides={"container_overrides": [container_override]}
   )
-  logger.info(f"Triggering Cloud Run Job: {JOB_RESOURCE}")
+  logger.info(f"Triggering Cloud Run Job: {CFG.job_resource}")
   try:
-    op = _jobs_client.run_job(request=request)
+    op = _jobs_client.run_job(request=request, timeout=RUN_JOB_TIMEOUT)
     operation_id = op.operation.name
     logger.info(f"Cloud Run operation started: {operation_id}")
     return operation_id, Status(ok=True)
@@ -51,4 +55,5 @@ def trigger_download_job(
     logger.error(f"Retry error: {e}")
     return None, Status(ok=False, message=str(e))
   except ValueError as e:
-    return None, Status(ok=False, message=e.message)
\ No newline at end of file
+    logger.error(f"Invalid job request: {e}")
+    return None, Status(ok=False, message=str(e))
\ No newline at end of file
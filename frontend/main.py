@@ -1,32 +1,48 @@
 import logging
 import re
-from distutils.util import strtobool
 
+import orjson # type: ignore
 from flask import Flask, request, jsonify # type: ignore
+from flask.json.provider import DefaultJSONProvider # type: ignore
 from frontend.job_trigger import trigger_download_job
-from frontend.config import FLASK_HOST, FLASK_PORT
+from frontend.config import CFG
+
+class OrjsonProvider(DefaultJSONProvider):
+  """
+  Flask JSON provider backed by orjson for request parsing and responses.
+  """
+  def dumps(self, obj, **kwargs) -> str:
+    return orjson.dumps(obj, default=self.default).decode()
+
+  def loads(self, s, **kwargs):
+    return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+_DATASET_RE = re.compile(r"[a-zA-Z0-9_-]+/[a-zA-Z0-9_-]+")
+# Relative path: no leading/trailing slash, no empty, "." or ".." components
+_SUFFIX_RE = re.compile(r"(?!/)(?!.*/$)(?!.*//)(?!.*(?:^|/)\.\.?(?:/|$)).+")
+
 def is_valid_dataset(dataset: str) -> bool:
-  return bool(re.fullmatch(r"[a-zA-Z0-9_-]+/[a-zA-Z0-9_-]+", dataset))
+  return _DATASET_RE.fullmatch(dataset) is not None
 
 def is_valid_suffix_format(suffix: str) -> bool:
-  if suffix.startswith("/") or suffix.endswith("/"):
-    return False
-  parts = suffix.split("/")
-  return all(part and part not in (".", "..") for part in parts)
+  return _SUFFIX_RE.fullmatch(suffix) is not None
 
 @app.route('/enqueue', methods=['POST'])
 def enqueue():
-  data = request.get_json(force=True)
+  data = request.get_json(force=True, silent=True)
+  if not isinstance(data, dict):
+    return jsonify({'error': "Request body must be a JSON object"}), 400
+
   dataset = data.get('dataset')
   source = data.get('source')
-  dest_suffix = data.get('dest_suffix', '')
+  dest_suffix = data.get('dest_suffix')
 
   if not isinstance(dataset, str) or not dataset.strip():
     return jsonify({'error': "'dataset' must be a non-empty string"}), 400
@@ -34,9 +50,12 @@ def enqueue():
   if not is_valid_dataset(dataset):
     return jsonify({'error': f"Non valid 'dataset' field {dataset}"}), 400
 
-  if not source or source not in ['kaggle', 'huggingface']:
+  if not isinstance(source, str) or source not in ['kaggle', 'huggingface']:
     return jsonify({'error': f"Non valid 'source' field {source}"}), 400
 
+  if dest_suffix is not None and not isinstance(dest_suffix, str):
+    return jsonify({'error': "'dest_suffix' must be a string"}), 400
+
   if dest_suffix and not is_valid_suffix_format(dest_suffix):
     return jsonify({'error': f"Invalid destination suffix: {dest_suffix}"}), 400
 
@@ -57,5 +76,6 @@ def enqueue():
     'execution': operation_id
   }), 202
 
+# Local development only; containers serve the app with gunicorn_conf.py.
 if __name__ == '__main__':
-    app.run(host=FLASK_HOST, port=FLASK_PORT)
\ No newline at end of file
+    app.run(host=CFG.flask_host, port=CFG.flask_port)
\ No newline at end of file
@@ -1,4 +1,7 @@
 import os
 
 # Default mount path for Filestore
-FILERESTORE_MOUNT_PATH = os.getenv("FILERESTORE_MOUNT_PATH", "/mnt/filestore")
\ No newline at end of file
+FILERESTORE_MOUNT_PATH = os.getenv("FILERESTORE_MOUNT_PATH", "/mnt/filestore")
+
+# Number of top-level entries deleted in parallel
+DELETE_WORKERS = int(os.getenv("DELETE_WORKERS", "16"))
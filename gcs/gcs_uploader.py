@@ -1,45 +1,369 @@
-import time
+import base64
+import functools
 import logging
+import multiprocessing
 import os
+import re
+import tarfile
+import threading
+from concurrent.futures import (
+  FIRST_COMPLETED,
+  ProcessPoolExecutor,
+  ThreadPoolExecutor,
+  as_completed,
+  wait,
+)
 
+import google.auth # type: ignore
+import google_crc32c # type: ignore
+import requests # type: ignore
+from google.auth.transport.requests import AuthorizedSession # type: ignore
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
+from google.api_core import exceptions, retry # type: ignore
 from tqdm import tqdm # type: ignore
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configure logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# GCS Client
-_storage_client = storage.Client()
+# GCS clients, one per thread, created on first upload so their connection
+# pools can be sized to the number of upload threads. Separate clients keep
+# the download/upload pool threads from contending on one client's session.
+_tls = threading.local()
+
+# Payload integrity is checked with hardware-accelerated CRC32C (google-crc32c)
+# rather than MD5, which is far slower on large parquet shards.
+if google_crc32c.implementation != "c":
+  logger.warning(
+    "google-crc32c is using its pure-Python implementation; upload checksums "
+    "will be very slow. Reinstall google-crc32c with its C extension."
+  )
+
+# Files above this size are split into parallel XML multipart chunk uploads.
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+# Smallest chunk used for chunked uploads. Files below this size are sent in a
+# single request, without opening a resumable session.
+MIN_CHUNK_SIZE = 8 * 1024 * 1024
+
+# With packing enabled, files below PACK_FILE_THRESHOLD are streamed into tar
+# archives of about PACK_PART_SIZE bytes instead of one object per file.
+PACK_FILE_THRESHOLD = 4 * 1024 * 1024
+PACK_PART_SIZE = 256 * 1024 * 1024
+
+# At most this many uploads per upload worker are queued or running at once,
+# so the walk stays ahead of the uploads while memory stays bounded.
+UPLOAD_WINDOW_PER_WORKER = 4
+# Large files each upload upload_worker chunks in parallel, so only a few of
+# them run at the same time.
+LARGE_FILE_WORKERS = 2
+# Caps the large files that upload_file callers upload at the same time.
+_large_slots = threading.BoundedSemaphore(LARGE_FILE_WORKERS)
+
+# Read size used when computing a local file's CRC32C.
+CRC32C_READ_SIZE = 4 * 1024 * 1024
+
+# Hidden, temp and cache directories, which are not uploaded.
+_SKIP = re.compile(r"\.|[Tt][Mm][Pp]|[Tt][Ee][Mm][Pp]|__pycache__\Z")
+
+# Only rate limiting, transient server errors and network errors are retried;
+# anything else (403, 404, ...) fails fast.
+_RETRY = retry.Retry(
+  predicate=retry.if_exception_type(
+    exceptions.TooManyRequests,
+    exceptions.ServiceUnavailable,
+    exceptions.InternalServerError,
+    ConnectionError,
+    requests.exceptions.ConnectionError,
+  ),
+  initial=0.5,
+  maximum=30.0,
+  multiplier=2.0,
+  timeout=600.0,
+)
+
+@functools.lru_cache(maxsize=None)
+def _default_credentials():
+  """
+    Resolve the application default credentials once per process; they are
+    shared by the per-thread clients. The storage scopes are requested here
+    because the AuthorizedSession uses these credentials directly, and
+    service account keys cannot fetch a token without a scope.
+  """
+  return google.auth.default(scopes=storage.Client.SCOPE)
+
+def _get_storage_client(pool_size: int) -> storage.Client:
+  """
+    Return this thread's GCS client, creating it on first use with an HTTP
+    connection pool large enough that its chunk upload threads never wait on,
+    or discard, pooled connections.
+  """
+  client = getattr(_tls, "client", None)
+  if client is None:
+    credentials, project = _default_credentials()
+    session = AuthorizedSession(credentials)
+    session.mount(
+      "https://",
+      requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size),
+    )
+    client = _tls.client = storage.Client(
+      project=project, credentials=credentials, _http=session
+    )
+  return client
+
+def _pick_chunk_size(size: int, max_chunk_size: int) -> int:
+  """
+    Choose a chunk size of about 1/8 of the file, rounded up to a power of two
+    and clamped to [MIN_CHUNK_SIZE, max_chunk_size].
+  """
+  chunk = 1 << max(size // 8 - 1, 0).bit_length()
+  return max(MIN_CHUNK_SIZE, min(chunk, max_chunk_size))
+
+def _crc32c_b64(local_path: str) -> str:
+  """
+    Compute the CRC32C of a local file, base64-encoded as in blob.crc32c.
+  """
+  checksum = google_crc32c.Checksum()
+  with open(local_path, "rb") as f:
+    while chunk := f.read(CRC32C_READ_SIZE):
+      checksum.update(chunk)
+  return base64.b64encode(checksum.digest()).decode("ascii")
+
+def _is_unchanged(blob: storage.Blob, local_path: str, size: int) -> bool:
+  """
+    Check whether "blob" already holds the content of "local_path". The
+    object's metadata is fetched first, and the local CRC32C is only computed
+    when the sizes match.
+  """
+  try:
+    blob.reload(retry=_RETRY)
+  except exceptions.NotFound:
+    return False
+  return blob.size == size and blob.crc32c == _crc32c_b64(local_path)
+
+def _matches(remote: tuple | None, local_path: str, size: int) -> bool:
+  """
+    Check whether "remote", an object's (size, crc32c) from a bucket
+    listing or None if there was no object, matches "local_path".
+  """
+  return (
+    remote is not None
+    and remote[0] == size
+    and remote[1] == _crc32c_b64(local_path)
+  )
+
+# Marks an _upload_one call made without a bucket listing.
+_UNLISTED = object()
 
 def _upload_one(
-    bucket: storage.Bucket,
-    local_path: str, 
+    bucket: str,
+    local_path: str,
     gcs_path: str,
-    chunk_size_mb: int, 
-    max_retries: int=3
-) -> None:
+    size: int,
+    chunk_size_mb: int,
+    upload_worker: int,
+    remote=_UNLISTED
+) -> bool:
   """
-    Upload a file to a GCS bucket with retries and exponential backoff.
+    Upload a large file to a GCS bucket as concurrent chunks, unless an
+    object with the same size and CRC32C already exists. Transient errors
+    are retried with jittered exponential backoff.
 
     Args:
-      bucket (storage.Bucket): The target GCS bucket.
+      bucket (str): Name of the target GCS bucket.
       local_path (str): Path to the local file.
       gcs_path (str): Target path in the GCS bucket.
-      max_retries (int): Number of retry attempts on failure.
+      size (int): Size of the local file in bytes.
+      chunk_size_mb (int): Upper bound of the uploaded chunk size in MiB.
+      upload_worker (int): Number of threads uploading chunks in parallel.
+      remote (tuple | None): The existing object's (size, crc32c) from a
+        bucket listing, or None if there was none. Without it, the object's
+        metadata is fetched.
+
+    Returns:
+      bool: True if the upload was skipped because the object is unchanged.
+  """
+  # Chunks are uploaded by upload_worker threads sharing this client
+  blob = _get_storage_client(upload_worker * 2).bucket(bucket).blob(gcs_path)
+  if remote is _UNLISTED:
+    unchanged = _is_unchanged(blob, local_path, size)
+  else:
+    unchanged = _matches(remote, local_path, size)
+  if unchanged:
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug(f"Skipped unchanged object gs://{bucket}/{gcs_path}")
+    return True
+  _RETRY(transfer_manager.upload_chunks_concurrently)(
+    local_path,
+    blob,
+    chunk_size=_pick_chunk_size(size, chunk_size_mb * 1024 * 1024),
+    worker_type=transfer_manager.THREAD,
+    max_workers=upload_worker,
+    checksum="crc32c",
+  )
+  return False
+
+def _upload_packed(
+    bucket: str,
+    files: list,
+    gcs_path: str,
+    gcs_prefix: str,
+    chunk_size_mb: int
+) -> None:
   """
-  blob = bucket.blob(gcs_path)
-  blob.chunk_size = chunk_size_mb * 1024 * 1024
-  for attempt in range(max_retries):
+    Stream a group of small files into a single tar object in GCS.
+
+    Args:
+      bucket (str): Name of the target GCS bucket.
+      files (list): Tuples (local_path, gcs_path) of the files to pack.
+      gcs_path (str): Target path of the tar archive in the GCS bucket.
+      gcs_prefix (str): Prefix stripped from each file's GCS path to form its
+        name inside the archive.
+      chunk_size_mb (int): Size of each resumable upload chunk in MiB.
+  """
+  blob = _get_storage_client(1).bucket(bucket).blob(gcs_path)
+  with blob.open("wb", chunk_size=chunk_size_mb * 1024 * 1024) as f:
+    with tarfile.open(fileobj=f, mode="w|") as tar:
+      for lp, gp in files:
+        tar.add(lp, arcname=gp[len(gcs_prefix):])
+
+def _iter_files(root: str, gcs_prefix: str, parquet_only: bool):
+  """
+    Yield (local_path, gcs_path, size) for every file under "root",
+    skipping temp and cache directories. Paths are built once per directory
+    and extended by name, and sizes are read with stat() relative to the
+    open directory fd, so nothing re-resolves the full path from the root.
+  """
+  for dirpath, dirs, files, dirfd in os.fwalk(root):
+    # Exclude any temp or cache directories
+    dirs[:] = [d for d in dirs if not _SKIP.match(d)]
+    rel_dir = dirpath[len(root):].lstrip(os.sep)
+    dir_prefix = f"{gcs_prefix}{rel_dir}/" if rel_dir else gcs_prefix
+    dir_slash = os.path.join(dirpath, "")
+    for fname in files:
+      if parquet_only and not fname.endswith('.parquet'):
+        continue
+      try:
+        size = os.stat(fname, dir_fd=dirfd).st_size
+      except OSError as e:
+        logger.error(f"Skipping unreadable file {dir_slash + fname}: {e}")
+        continue
+      yield dir_slash + fname, dir_prefix + fname, size
+
+def upload_file(
+    bucket: str,
+    local_path: str,
+    gcs_path: str,
+    upload_worker: int,
+    chunk_size_mb: int,
+    size: int | None = None) -> None:
+  """
+  Upload a single file to GCS, e.g. as soon as it has been downloaded.
+
+  Uses the same rules as upload_files: large files are uploaded as concurrent
+  chunks, others in a single request. Objects that already hold the same
+  content are skipped, and objects whose content differs are overwritten.
+  Pass "size" when it is already known to avoid a stat() of the file.
+
+  At most LARGE_FILE_WORKERS large files are uploaded at once across all
+  callers, as in upload_files, since each holds upload_worker chunks in
+  memory; other callers wait for a free slot.
+  """
+  if size is None:
+    size = os.path.getsize(local_path)
+  if size > LARGE_FILE_THRESHOLD:
+    with _large_slots:
+      _upload_one(bucket, local_path, gcs_path, size, chunk_size_mb, upload_worker)
+    return
+  # Size this thread's client for the large files it may upload later
+  _get_storage_client(upload_worker * 2)
+  _upload_small(bucket, local_path, gcs_path, size)
+
+def _init_worker() -> None:
+  """
+    Create an upload worker's GCS client when the worker starts, so each
+    worker fetches credentials once instead of on its first upload.
+  """
+  _get_storage_client(1)
+
+def _upload_small(
+    bucket: str,
+    local_path: str,
+    gcs_path: str,
+    size: int,
+    remote: tuple | None = None
+) -> bool:
+  """
+    Upload a small file in a single request. Runs in an upload pool worker,
+    thread or process, with that worker's own client.
+
+    "remote" is the (size, crc32c) of the existing object, taken from the
+    bucket listing, or None if there was no object. An existing object with
+    the same content is skipped and one whose content differs is
+    overwritten. A missing object is created with if_generation_match=0; if
+    one appeared after the listing, it is checked the same way.
+
+    Returns:
+      bool: True if the upload was skipped because the object is unchanged.
+  """
+  blob = _get_storage_client(1).bucket(bucket).blob(gcs_path)
+  if remote is None:
     try:
-      blob.upload_from_filename(local_path)
-      return
+      blob.upload_from_filename(
+        local_path, if_generation_match=0, retry=_RETRY, checksum="crc32c"
+      )
+      return False
+    except exceptions.PreconditionFailed:
+      unchanged = _is_unchanged(blob, local_path, size)
+  else:
+    unchanged = _matches(remote, local_path, size)
+  if unchanged:
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug(f"Skipped unchanged object gs://{bucket}/{gcs_path}")
+    return True
+  blob.upload_from_filename(local_path, retry=_RETRY, checksum="crc32c")
+  return False
+
+def _list_existing(bucket: str, gcs_prefix: str) -> dict:
+  """
+    List the objects under "gcs_prefix" once, as {name: (size, crc32c)},
+    so re-runs can compare small files without a request per file.
+  """
+  blobs = _get_storage_client(1).list_blobs(
+    bucket, prefix=gcs_prefix, fields="items(name,size,crc32c),nextPageToken"
+  )
+  return {b.name: (b.size, b.crc32c) for b in blobs}
+
+def _upload_pool(upload_worker: int, worker_type: str):
+  """
+    Create the pool that uploads small files for a whole upload_files run.
+    Worker processes are spawned rather than forked, so they do not inherit
+    the parent's gRPC state or threads that are in the middle of uploads.
+  """
+  if worker_type == transfer_manager.PROCESS:
+    return ProcessPoolExecutor(
+      max_workers=upload_worker,
+      mp_context=multiprocessing.get_context("spawn"),
+      initializer=_init_worker,
+    )
+  return ThreadPoolExecutor(max_workers=upload_worker, initializer=_init_worker)
+
+def _harvest(done, in_flight: dict) -> int:
+  """
+    Collect finished uploads and drop them from "in_flight", which maps each
+    future to the file or archive it uploads. Failures are logged.
+
+    Returns:
+      int: The number of uploads skipped because the object already existed.
+  """
+  skipped = 0
+  for f in done:
+    name = in_flight.pop(f)
+    try:
+      skipped += bool(f.result())
     except Exception as e:
-      if attempt < max_retries - 1:
-        time.sleep(2 ** attempt)  # Exponential backoff
-      else:
-        raise
+      logger.error(f"Upload error for {name}: {e}")
+  return skipped
 
 def upload_files(
     source: str,
@@ -48,51 +372,87 @@ def upload_files(
     dest_prefix: str,
     upload_worker: int,
     chunk_size_mb: int,
-    parquet_only: bool = False) -> str:
+    parquet_only: bool = False,
+    pack_small_files: bool = False,
+    worker_type: str = transfer_manager.THREAD) -> str:
   """
   Walk "source", find all files, and upload to GCS in parallel.
+
+  Uploads start while the walk is still running: every file is submitted as
+  soon as it is found, and the walk only pauses while
+  UPLOAD_WINDOW_PER_WORKER * upload_worker uploads are in flight. Files
+  larger than LARGE_FILE_THRESHOLD are uploaded as concurrent chunks on
+  their own small pool, so they never hold up the small files. If
+  "pack_small_files" is set, files below PACK_FILE_THRESHOLD are uploaded as
+  part-NNNNN.tar archives instead of individual objects.
+
+  On re-runs, objects whose size and CRC32C match the local file are
+  skipped and objects that differ are overwritten, so a re-run after an
+  upstream update never leaves stale objects behind. Small files are
+  compared against one listing of the destination prefix.
+
+  "worker_type" selects threads or processes for the small-file uploads.
+  Processes avoid GIL contention in the client when there are many files;
+  one pool of either kind is created per call and reused for every file.
   """
-  gcs_bucket = _storage_client.bucket(bucket)
-  # Tuples (filestore, gcs) of file locations to be uploaded
-  to_upload = []
-  for root, dirs, files in os.walk(source):
-    # Exclude any temp or cache directories
-    dirs[:] = [
-      d for d in dirs if not (
-        d.startswith('.') or
-        d.lower().startswith('tmp') or
-        d.lower().startswith('temp') or
-        d == '__pycache__'
-      )
-    ]
-    for fname in files:
-      if parquet_only and not fname.endswith('.parquet'):
-        continue
-      local_path = os.path.join(root, fname)
-      rel_path = os.path.relpath(local_path, source)
-      gcs_path = os.path.join(dest_prefix, repo_id, rel_path).lstrip("/")
-      to_upload.append((local_path, gcs_path))
-
-  # Log the first up to 10 files to upload
-  sample = to_upload[:10]
-  logger.info("First files to upload:")
-  for lp, gp in sample:
-    logger.info(f" - {lp} -> gs://{bucket}/{gp}")
-
-  logger.info(f"Uploading {len(to_upload)} parquet files to GCS in parallel…")
-  logger.info(f"Uploading files to GCS with {upload_worker} workers and {chunk_size_mb}MB chunks...")
-
-  # Parallel upload
-  with ThreadPoolExecutor(max_workers=upload_worker) as executor:
-    futures = [
-      executor.submit(_upload_one, gcs_bucket, lp, gp, chunk_size_mb)
-      for lp, gp in to_upload
-    ]
-    for f in tqdm(as_completed(futures), total=len(futures)):
-      try:
-        f.result()
-      except Exception as e:
-        logging.error("Upload error:", e)
+  gcs_prefix = f"{dest_prefix}/{repo_id}/".lstrip("/")
+  existing = _list_existing(bucket, gcs_prefix)
+
+  logger.info(f"Uploading files to GCS with {upload_worker} workers and chunks of up to {chunk_size_mb}MB...")
+
+  window = UPLOAD_WINDOW_PER_WORKER * upload_worker
+  files = skipped = parts = 0
+  # The tar archive being filled when packing
+  part, part_bytes = [], 0
+  # Submitted uploads, mapped to the file or archive they upload
+  in_flight = {}
+  with _upload_pool(upload_worker, worker_type) as pool, \
+      ThreadPoolExecutor(max_workers=LARGE_FILE_WORKERS) as large:
+    for lp, gp, size in tqdm(
+        _iter_files(source, gcs_prefix, parquet_only), unit="file",
+        mininterval=5.0):
+      # Log the first up to 10 files to upload
+      if files < 10:
+        logger.info(f" - {lp} -> gs://{bucket}/{gp}")
+      files += 1
+
+      if pack_small_files and size < PACK_FILE_THRESHOLD:
+        part.append((lp, gp))
+        part_bytes += size
+        if part_bytes < PACK_PART_SIZE:
+          continue
+        name = f"{gcs_prefix}part-{parts:05d}.tar"
+        in_flight[pool.submit(
+          _upload_packed, bucket, part, name, gcs_prefix, chunk_size_mb
+        )] = name
+        parts += 1
+        part, part_bytes = [], 0
+      elif size > LARGE_FILE_THRESHOLD:
+        # Chunked parallel upload of large files
+        in_flight[large.submit(
+          _upload_one, bucket, lp, gp, size, chunk_size_mb, upload_worker,
+          existing.get(gp)
+        )] = lp
+      else:
+        in_flight[pool.submit(
+          _upload_small, bucket, lp, gp, size, existing.get(gp)
+        )] = lp
+
+      if len(in_flight) >= window:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        skipped += _harvest(done, in_flight)
+
+    if part:
+      name = f"{gcs_prefix}part-{parts:05d}.tar"
+      in_flight[pool.submit(
+        _upload_packed, bucket, part, name, gcs_prefix, chunk_size_mb
+      )] = name
+      parts += 1
+    skipped += _harvest(as_completed(list(in_flight)), in_flight)
 
-  logger.info("All files uploaded to GCS.")
-  return os.path.join(bucket, dest_prefix, repo_id)
\ No newline at end of file
+  if parts:
+    logger.info(f"Packed small files into {parts} tar archives")
+  if skipped:
+    logger.info(f"Skipped {skipped} files unchanged in gs://{bucket}")
+  logger.info(f"All {files} files uploaded to GCS.")
+  return f"{bucket}/{gcs_prefix}".rstrip("/")
@@ -1,9 +1,16 @@
+import atexit
 import logging
 import json
 import datetime
 
 from google.cloud import pubsub_v1
-from concurrent.futures import TimeoutError
+from google.cloud.pubsub_v1.types import (
+  BatchSettings,
+  LimitExceededBehavior,
+  PublishFlowControl,
+  PublisherOptions,
+)
+from concurrent.futures import wait
 from google.api_core import exceptions # type: ignore
 
 from util.status import Status
@@ -13,6 +20,17 @@ from pubsub.message_pb2 import DatasetDownloadComplete
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Coalesce messages published within a short window into a single RPC.
+_BATCH_SETTINGS = BatchSettings(max_messages=100, max_bytes=1 << 20, max_latency=0.1)
+# Block publishers instead of buffering unboundedly when the backlog grows.
+_PUBLISHER_OPTIONS = PublisherOptions(
+  flow_control=PublishFlowControl(
+    message_limit=1000,
+    byte_limit=10 * 1024 * 1024,
+    limit_exceeded_behavior=LimitExceededBehavior.BLOCK,
+  )
+)
+
 class Publisher:
   """
     Initializes the Publisher client.
@@ -26,10 +44,19 @@ class Publisher:
     self.topic = topic
     self.client = None
     self.topic_path = None
+    # Futures of messages handed to the client but not yet confirmed
+    self._pending = []
     try:
       # Initialize the client. This can fail if authentication is not set up.
-      self.client = pubsub_v1.PublisherClient()
+      self.client = pubsub_v1.PublisherClient(
+        batch_settings=_BATCH_SETTINGS,
+        publisher_options=_PUBLISHER_OPTIONS,
+      )
       self.topic_path = self.client.topic_path(project, topic)
+      # Fallback for callers that exit without calling flush(); Python 3.12+
+      # cannot start the client's publishing threads at shutdown, so
+      # callers should flush() explicitly
+      atexit.register(self.flush)
       logging.info(f"Publisher initialized for topic: {self.topic_path}")
     except exceptions.GoogleAPICallError as e:
       logging.error(f"Failed to initialize Pub/Sub client for project '{project}': {e}")
@@ -39,6 +66,11 @@ class Publisher:
       raise
 
   def publish(self, dataset: str, destination: str) -> Status:
+    """
+      Hands the message to the client's background batcher and returns
+      without waiting for the RPC. Call flush() before exiting to confirm
+      delivery; it also runs at exit as a fallback.
+    """
     msg = DatasetDownloadComplete(
       dataset=dataset,
       destination=destination,
@@ -48,27 +80,44 @@ class Publisher:
       # Data must be a bytestring
       data = msg.SerializeToString()
       # Publish the message. This returns a future.
-      future = self.client.publish(self.topic_path, data)
-      # Block until the message is published or the timeout is reached.
-      result = future.result(timeout=30)
-      logging.info(f"Published message ID {result} to {self.topic_path}")
+      self._pending.append(self.client.publish(self.topic_path, data))
       return Status(ok=True)
-    except TimeoutError:
-      logging.error(f"Publishing to {self.topic_path} timed out.")
-      return Status(
-        ok=False,
-        message=f"Publishing to {self.topic_path} timed out."
-      )
-    except exceptions.NotFound:
-      logging.error(f"Pub/Sub topic not found: {self.topic_path}")
-      return Status(
-        ok=False,
-        message=f"Pub/Sub topic not found: {self.topic_path}"
-      )
     except Exception as e:
       # This will catch other potential publishing errors.
       logging.error(f"An error occurred while publishing to {self.topic_path}: {e}")
       return Status(
         ok=False,
         message=f"An error occurred while publishing to {self.topic_path}: {e}"
-      )
\ No newline at end of file
+      )
+
+  def flush(self, timeout: float = 30) -> Status:
+    """
+      Blocks until every pending message is published or the timeout is
+      reached, and reports the first failure, if any.
+    """
+    pending, self._pending = self._pending, []
+    done, not_done = wait(pending, timeout=timeout)
+    if not_done:
+      logging.error(f"Publishing to {self.topic_path} timed out.")
+      return Status(
+        ok=False,
+        message=f"Publishing to {self.topic_path} timed out."
+      )
+    for future in done:
+      try:
+        result = future.result()
+        logging.info(f"Published message ID {result} to {self.topic_path}")
+      except exceptions.NotFound:
+        logging.error(f"Pub/Sub topic not found: {self.topic_path}")
+        return Status(
+          ok=False,
+          message=f"Pub/Sub topic not found: {self.topic_path}"
+        )
+      except Exception as e:
+        # This will catch other potential publishing errors.
+        logging.error(f"An error occurred while publishing to {self.topic_path}: {e}")
+        return Status(
+          ok=False,
+          message=f"An error occurred while publishing to {self.topic_path}: {e}"
+        )
+    return Status(ok=True)
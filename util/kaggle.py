@@ -1,9 +1,14 @@
 import os
+import hashlib
 import logging
 import requests # type: ignore
+import orjson # type: ignore
 import json
+import random
+import tempfile
 import time
-from typing import List
+from array import array
+from typing import Iterator, List
 from collections import defaultdict
 
 # Configure logging
@@ -12,58 +17,71 @@ logging.basicConfig(level=logging.INFO)
 
 MAX_RETRIES = 5
 BACKOFF_FACTOR = 1
+# Upper bound of the backoff before jitter, in seconds
+MAX_DELAY = 30
+# Up to this fraction of the backoff is added at random, so that workers
+# rate limited together do not retry in lockstep
+JITTER = 0.5
 
-def get_all_dataset_files(
+# (connect, read) timeout of each listing request, in seconds
+REQUEST_TIMEOUT = (5, 30)
+
+# Shared by all listing requests so pages reuse one keep-alive connection.
+# Retries are handled below, so the adapter itself never retries.
+_SESSION = requests.Session()
+_SESSION.mount(
+  "https://",
+  requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0),
+)
+# Complete file listings already fetched by this process, by dataset, as a
+# (names, sizes) pair of columns rather than one dictionary per file
+_listing_cache = {}
+
+# If KAGGLE_LISTING_CACHE_DIR is set, complete listings are also kept there
+# for LISTING_CACHE_TTL seconds, so repeated runs for the same dataset skip
+# pagination. Listings always follow the latest dataset version, so the TTL
+# is short: a new version is picked up at most that long after it appears.
+# Off by default, since Cloud Run Jobs start each run with an empty,
+# in-memory filesystem.
+LISTING_CACHE_DIR = os.getenv("KAGGLE_LISTING_CACHE_DIR")
+LISTING_CACHE_TTL = int(os.getenv("KAGGLE_LISTING_CACHE_TTL", "900"))
+
+def _fetch_dataset_files(
     owner_slug: str,
     dataset_slug: str,
     kaggle_username: str,
     kaggle_key: str,
-    page_size: int=200,
-  ) -> List[dict] | None:
+    page_size: int,
+  ) -> Iterator[dict]:
   """
-  Fetches the full list of files from a Kaggle dataset, handling token-based pagination.
+  Yields the files of a Kaggle dataset page by page from the API, handling
+  token-based pagination.
 
-  Args:
-    owner_slug (str): The username of the dataset owner.
-    dataset_slug (str): The name of the dataset.
-    kaggle_username (str): Kaggle username in kaggle.json.
-    kaggle_key (str): Kaggle key in kaggle.json.
-    page_size (int): Number of files contained in one response.
-
-  Returns:
-    list: A list of dictionaries, where each dictionary represents a file.
-          Returns None if there's an error.
+  Raises:
+    RuntimeError: If the listing cannot be completed. The cause is logged.
   """
-  all_files = []
   page_token = None
 
   if not kaggle_username or not kaggle_key:
     logging.error("Error: KAGGLE_USERNAME and KAGGLE_KEY environment variables are not set.")
-    return None
+    raise RuntimeError("Kaggle credentials are not set")
 
   base_url = f"https://www.kaggle.com/api/v1/datasets/list/{owner_slug}/{dataset_slug}"
+  # Built once; only the pageToken changes between pages
   params = {'pageSize': page_size}
-  # --- Retry logic variables ---
-  retries = 0
 
   while True:
-    # Set up parameters for the request, including the pageToken if available
-    if page_token:
-      params['pageToken'] = page_token
-  
     retries = 0
 
     while retries < MAX_RETRIES:
       try:
-        response = requests.get(base_url, auth=(kaggle_username, kaggle_key), params=params)
+        response = _SESSION.get(
+          base_url, auth=(kaggle_username, kaggle_key), params=params,
+          timeout=REQUEST_TIMEOUT
+        )
         response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
 
-        data = response.json()
-
-        # Safely get the list of files
-        files_on_page = data.get('datasetFiles', [])
-        if files_on_page:
-          all_files.extend(files_on_page)
+        data = orjson.loads(response.content)
         
         # Break the inner loop
         page_token = data.get('nextPageToken')
@@ -75,11 +93,15 @@ def get_all_dataset_files(
           retries += 1
           if retries >= MAX_RETRIES:
             logging.error(f"HTTP 429: Max retries reached for page. Aborting.")
-            # Return what we have so far, as this page could not be fetched.
-            return all_files
+            raise RuntimeError(f"Rate limited while listing {owner_slug}/{dataset_slug}") from errh
             
-          # Calculate sleep time with exponential backoff
-          sleep_time = BACKOFF_FACTOR * (2 ** retries)
+          # Calculate sleep time with capped, jittered exponential backoff;
+          # a server-provided Retry-After wins if it is longer.
+          sleep_time = min(MAX_DELAY, BACKOFF_FACTOR * (2 ** retries)) * (1 + random.uniform(0, JITTER))
+          try:
+            sleep_time = max(sleep_time, float(errh.response.headers.get("Retry-After", 0)))
+          except ValueError:
+            pass
           logging.info(f"HTTP 429: Too Many Requests. Retrying in {sleep_time:.2f} seconds... (Attempt {retries}/{MAX_RETRIES})")
           time.sleep(sleep_time)
           logging.info(f"Retry on pageToken: {page_token}")
@@ -90,24 +112,203 @@ def get_all_dataset_files(
             logging.error(f"Dataset not found: {owner_slug}/{dataset_slug}")
           elif errh.response.status_code == 401:
             logging.error("Authentication failed. Please check your Kaggle credentials.")
-          return None # Exit completely
+          raise RuntimeError(f"Failed to list {owner_slug}/{dataset_slug}: {errh}") from errh
       except requests.exceptions.ConnectionError as errc:
         logging.error(f"Error Connecting: {errc}")
-        return None
+        raise RuntimeError(f"Failed to list {owner_slug}/{dataset_slug}: {errc}") from errc
       except requests.exceptions.Timeout as errt:
         logging.error(f"Timeout Error: {errt}")
-        return None
+        raise RuntimeError(f"Failed to list {owner_slug}/{dataset_slug}: {errt}") from errt
       except requests.exceptions.RequestException as err:
         logging.error(f"Something went wrong: {err}")
-        return None
-      except json.JSONDecodeError:
+        raise RuntimeError(f"Failed to list {owner_slug}/{dataset_slug}: {err}") from err
+      except json.JSONDecodeError as errj:  # orjson.JSONDecodeError subclasses it
         logging.error(f"Failed to decode JSON from response: {response.text}")
-        return None
+        raise RuntimeError(f"Failed to list {owner_slug}/{dataset_slug}: {errj}") from errj
+
+    # Safely get the list of files
+    yield from data.get('datasetFiles') or ()
 
     # Get the token for the next page. If it's not present or None, the loop will terminate.
-    if not page_token or len(page_token) == 0:
+    if not page_token:
       break
-  return all_files
+    params['pageToken'] = page_token
+
+def _listing_cache_path(owner_slug: str, dataset_slug: str) -> str | None:
+  """
+  Return the on-disk cache file of a dataset's listing, or None if the disk
+  cache is disabled.
+  """
+  if not LISTING_CACHE_DIR:
+    return None
+  key = hashlib.sha256(f"{owner_slug}/{dataset_slug}".encode()).hexdigest()
+  return os.path.join(LISTING_CACHE_DIR, f"{key}.json")
+
+def _read_cached_listing(path: str | None) -> tuple | None:
+  """
+  Return the (names, sizes) listing cached at "path", or None if it is
+  missing, expired or unreadable, or if the disk cache is disabled.
+  """
+  if path is None:
+    return None
+  try:
+    if time.time() - os.stat(path).st_mtime > LISTING_CACHE_TTL:
+      return None
+    with open(path, "rb") as f:
+      data = orjson.loads(f.read())
+    return data["name"], array("q", data["totalBytes"])
+  except (OSError, orjson.JSONDecodeError, KeyError, TypeError):
+    return None
+
+def _write_cached_listing(path: str | None, names: List[str], sizes: array) -> None:
+  """
+  Atomically write a listing to "path", so concurrent readers and writers
+  only ever see a complete file. Failures are logged and ignored. Nothing
+  is written if the disk cache is disabled.
+  """
+  if path is None:
+    return
+  try:
+    os.makedirs(LISTING_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=LISTING_CACHE_DIR, suffix=".tmp")
+    try:
+      with os.fdopen(fd, "wb") as f:
+        f.write(orjson.dumps({"name": names, "totalBytes": sizes.tolist()}))
+      os.replace(tmp_path, path)
+    except BaseException:
+      os.unlink(tmp_path)
+      raise
+  except OSError as e:
+    logging.warning(f"Could not cache file listing at {path}: {e}")
+
+def _append_file(names: List[str], sizes: array, f: dict) -> None:
+  """
+  Append a file of the API listing to the name and size columns, with -1
+  for an unknown size.
+  """
+  names.append(f.get('name', 'N/A'))
+  size = f.get('totalBytes')
+  sizes.append(-1 if size is None else size)
+
+def _cached_listing(owner_slug: str, dataset_slug: str) -> tuple | None:
+  """
+  Return a dataset's cached (names, sizes) columns from this process or,
+  failing that, from disk, or None if it is not cached.
+  """
+  cache_key = (owner_slug, dataset_slug)
+  columns = _listing_cache.get(cache_key)
+  if columns is None:
+    columns = _read_cached_listing(_listing_cache_path(owner_slug, dataset_slug))
+    if columns is not None:
+      _listing_cache[cache_key] = columns
+  return columns
+
+def _cache_listing(
+    owner_slug: str, dataset_slug: str, names: List[str], sizes: array
+  ) -> None:
+  """
+  Cache a dataset's complete listing in this process and, if enabled, on
+  disk.
+  """
+  _listing_cache[(owner_slug, dataset_slug)] = (names, sizes)
+  _write_cached_listing(_listing_cache_path(owner_slug, dataset_slug), names, sizes)
+
+def iter_all_dataset_files(
+    owner_slug: str,
+    dataset_slug: str,
+    kaggle_username: str,
+    kaggle_key: str,
+    page_size: int=200,
+  ) -> Iterator[dict]:
+  """
+  Yields the files of a Kaggle dataset, so callers can start on the first
+  files while later pages are still being fetched.
+
+  Complete listings are cached for the lifetime of the process, and, if
+  enabled, on disk under LISTING_CACHE_DIR for LISTING_CACHE_TTL; a cached
+  listing is yielded without any request. A listing streamed from the API
+  is cached once its last page has been yielded. Only names and sizes are
+  cached, so files yielded from a cache carry just 'name' and 'totalBytes'.
+
+  Args:
+    owner_slug (str): The username of the dataset owner.
+    dataset_slug (str): The name of the dataset.
+    kaggle_username (str): Kaggle username in kaggle.json.
+    kaggle_key (str): Kaggle key in kaggle.json.
+    page_size (int): Number of files contained in one response.
+
+  Yields:
+    dict: One dictionary per file.
+
+  Raises:
+    RuntimeError: If the listing cannot be completed. The cause is logged.
+  """
+  columns = _cached_listing(owner_slug, dataset_slug)
+  if columns is None:
+    names, sizes = [], array("q")
+    for f in _fetch_dataset_files(
+        owner_slug, dataset_slug, kaggle_username, kaggle_key, page_size):
+      _append_file(names, sizes, f)
+      yield f
+    _cache_listing(owner_slug, dataset_slug, names, sizes)
+    return
+  for name, size in zip(*columns):
+    yield {'name': name, 'totalBytes': None if size < 0 else size}
+
+def get_all_dataset_files(
+    owner_slug: str,
+    dataset_slug: str,
+    kaggle_username: str,
+    kaggle_key: str,
+    page_size: int=200,
+  ) -> List[dict] | None:
+  """
+  Fetches the full list of files from a Kaggle dataset with
+  iter_all_dataset_files, and so from its caches when possible.
+
+  Returns:
+    list: A list of dictionaries, where each dictionary represents a file.
+          Returns None if there's an error.
+  """
+  try:
+    return list(iter_all_dataset_files(
+      owner_slug, dataset_slug, kaggle_username, kaggle_key, page_size
+    ))
+  except RuntimeError:
+    return None
+
+def get_all_dataset_files_soa(
+    owner_slug: str,
+    dataset_slug: str,
+    kaggle_username: str,
+    kaggle_key: str,
+    page_size: int=200,
+  ) -> dict | None:
+  """
+  Fetches the names and sizes of a Kaggle dataset's files as two parallel
+  columns instead of one dictionary per file, for callers that keep the
+  listing around. The columns are what the listing caches hold, so a cached
+  listing is returned as is and a fetched one never keeps the per-file
+  dictionaries.
+
+  Returns:
+    dict: {"name": list of file names, "totalBytes": array('q') of sizes,
+          -1 where the size is unknown}, in listing order. The columns are
+          shared with the cache and must not be modified. Returns None if
+          there's an error.
+  """
+  columns = _cached_listing(owner_slug, dataset_slug)
+  if columns is None:
+    names, sizes = [], array("q")
+    try:
+      for f in _fetch_dataset_files(
+          owner_slug, dataset_slug, kaggle_username, kaggle_key, page_size):
+        _append_file(names, sizes, f)
+    except RuntimeError:
+      return None
+    _cache_listing(owner_slug, dataset_slug, names, sizes)
+    columns = names, sizes
+  return {"name": columns[0], "totalBytes": columns[1]}
 
 if __name__ == '__main__':
   # Set your Kaggle username and key as environment variables before running
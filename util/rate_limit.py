@@ -0,0 +1,32 @@
+import threading
+import time
+
+class TokenBucket:
+  """
+    Thread-safe token bucket that spaces out calls to a rate-limited remote.
+
+    Args:
+      rate (float): Tokens added per second, i.e. the sustained call rate.
+      burst (int): Maximum number of tokens that can accumulate.
+  """
+  def __init__(self, rate: float, burst: int):
+    self.rate = rate
+    self.capacity = burst
+    self._tokens = float(burst)
+    self._last = time.monotonic()
+    self._lock = threading.Lock()
+
+  def acquire(self) -> None:
+    """Blocks until a token is available, then consumes it."""
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(
+          self.capacity, self._tokens + (now - self._last) * self.rate
+        )
+        self._last = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        wait = (1 - self._tokens) / self.rate
+      time.sleep(wait)
@@ -1,29 +1,59 @@
 import os
+from dataclasses import dataclass, field
 from dotenv import load_dotenv # type: ignore
 
-# Load environment variables from .env
-load_dotenv()
+# Load environment variables from .env for local runs. CLOUD_RUN_JOB is always set
+# by Cloud Run, where the environment is injected by the platform.
+if os.getenv("CLOUD_RUN_JOB") is None:
+  load_dotenv()
 
-# Hugging Face Hub token environment variable
-HF_HUB_TOKEN = os.getenv("HF_HUB_TOKEN")
 
-# Kaggle
-KAGGLE_USERNAME = os.getenv("KAGGLE_USERNAME")
-KAGGLE_KEY = os.getenv("KAGGLE_KEY")
-KAGGLE_DOWNLOAD_WORKER = int(os.getenv("KAGGLE_DOWNLOAD_WORKER", "5"))
+@dataclass(frozen=True, slots=True)
+class Config:
+  """Immutable snapshot of the worker settings, read once at import."""
+  # Hugging Face Hub token environment variable
+  hf_hub_token: str | None = field(repr=False)
+  hf_download_workers: int
+  # Kaggle
+  kaggle_username: str | None
+  kaggle_key: str | None = field(repr=False)
+  kaggle_download_worker: int
+  kaggle_requests_per_second: float
+  kaggle_request_burst: int
+  # Default mount path for Filestore
+  filerestore_mount_path: str
+  # GCS
+  gcs_bucket: str
+  gcs_hugging_face_prefix: str  # optional sub-folder
+  gcs_kaggle_prefix: str  # optional sub-folder
+  # Upload tuning
+  upload_workers: int
+  chunk_size_mb: int
+  pack_small_files: bool  # pack tiny files into tar archives before upload
+  upload_worker_type: str  # "process" or "thread" pool for small-file uploads
+  # Pubsub
+  google_cloud_project: str | None
+  pubsub_topic: str
 
-# Default mount path for Filestore
-FILERESTORE_MOUNT_PATH = os.getenv("FILERESTORE_MOUNT_PATH", "/mnt/filestore")
 
-# GCS
-GCS_BUCKET = os.getenv("GCS_BUCKET", "3p-datasets-bucket")
-GCS_HUGGING_FACE_PREFIX = os.getenv("GCS_HUGGING_FACE_PREFIX", "huggingface")  # optional sub-folder
-GCS_KAGGLE_PREFIX = os.getenv("GCS_KAGGLE_PREFIX", "kaggle")  # optional sub-folder
-
-# Upload tuning
-UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "10"))   # default 4 threads
-CHUNK_SIZE_MB  = int(os.getenv("CHUNK_SIZE_MB",  "128"))   # default 8 MiB
-
-# Pubsub
-GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
-PUBSUB_TOPIC = os.getenv("PUBSUB_TOPIC", "dataset-download-complete")
\ No newline at end of file
+CFG = Config(
+  hf_hub_token=os.getenv("HF_HUB_TOKEN"),
+  hf_download_workers=int(
+    os.getenv("HF_DOWNLOAD_WORKERS", str(min(32, (os.cpu_count() or 1) * 4)))
+  ),
+  kaggle_username=os.getenv("KAGGLE_USERNAME"),
+  kaggle_key=os.getenv("KAGGLE_KEY"),
+  kaggle_download_worker=int(os.getenv("KAGGLE_DOWNLOAD_WORKER", "5")),
+  kaggle_requests_per_second=float(os.getenv("KAGGLE_REQUESTS_PER_SECOND", "5")),
+  kaggle_request_burst=int(os.getenv("KAGGLE_REQUEST_BURST", "10")),
+  filerestore_mount_path=os.getenv("FILERESTORE_MOUNT_PATH", "/mnt/filestore"),
+  gcs_bucket=os.getenv("GCS_BUCKET", "3p-datasets-bucket"),
+  gcs_hugging_face_prefix=os.getenv("GCS_HUGGING_FACE_PREFIX", "huggingface"),
+  gcs_kaggle_prefix=os.getenv("GCS_KAGGLE_PREFIX", "kaggle"),
+  upload_workers=int(os.getenv("UPLOAD_WORKERS", "10")),
+  chunk_size_mb=int(os.getenv("CHUNK_SIZE_MB", "128")),
+  pack_small_files=os.getenv("PACK_SMALL_FILES", "false").lower() in ("1", "true", "yes"),
+  upload_worker_type=os.getenv("UPLOAD_WORKER_TYPE", "process"),
+  google_cloud_project=os.getenv("GOOGLE_CLOUD_PROJECT"),
+  pubsub_topic=os.getenv("PUBSUB_TOPIC", "dataset-download-complete"),
+)
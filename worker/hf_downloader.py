@@ -1,19 +1,23 @@
 import os
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from huggingface_hub import snapshot_download # type: ignore
-from config import (
-  HF_HUB_TOKEN,
-  FILERESTORE_MOUNT_PATH,
-  GCS_BUCKET,
-  GCS_HUGGING_FACE_PREFIX,
-  UPLOAD_WORKERS,
-  CHUNK_SIZE_MB,
-  GOOGLE_CLOUD_PROJECT,
-  PUBSUB_TOPIC,
-)
-from gcs.gcs_uploader import upload_files
+# Enable the multi-connection Xet download path, and hf_transfer for repos not
+# backed by Xet. huggingface_hub reads these at import time, so they are set
+# before it is imported; values already in the environment take precedence.
+os.environ.setdefault("HF_XET_HIGH_PERFORMANCE", "1")
+os.environ.setdefault("HF_XET_NUM_CONCURRENT_RANGE_GETS", "64")
+os.environ.setdefault("HF_XET_CHUNK_CACHE_SIZE_BYTES", "0")
+os.environ.setdefault("HF_XET_RECONSTRUCT_WRITE_SEQUENTIALLY", "0")
+os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
+from huggingface_hub import HfApi, hf_hub_download, snapshot_download # type: ignore
+from huggingface_hub.hf_api import RepoFile # type: ignore
+from huggingface_hub.utils import filter_repo_objects # type: ignore
+from tqdm import tqdm # type: ignore
+from config import CFG
+from gcs.gcs_uploader import upload_file, upload_files
 from util.huggingface import check_datasets_server_parquet_status
 from pubsub.publish import Publisher
 
@@ -21,7 +25,91 @@ from pubsub.publish import Publisher
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-publisher = Publisher(project=GOOGLE_CLOUD_PROJECT, topic=PUBSUB_TOPIC)
+publisher = Publisher(project=CFG.google_cloud_project, topic=CFG.pubsub_topic)
+
+def _download_and_upload(
+  repo_id: str,
+  dest: str,
+  snapshot_kwargs: dict
+) -> str:
+  """
+  Download the repo files in parallel and upload each one to GCS as soon as
+  it lands in `dest`, so the download and upload phases overlap.
+  Files are scheduled largest first so a big file does not start last and
+  leave a long tail. Returns the GCS destination of the dataset.
+  """
+  revision = snapshot_kwargs.get("revision")
+  token = snapshot_kwargs.get("token")
+  # One listing call provides both the paths and the sizes
+  repo_files = sorted(
+    filter_repo_objects(
+      (
+        f for f in HfApi().list_repo_tree(
+          repo_id, repo_type="dataset", revision=revision, token=token,
+          recursive=True,
+        )
+        if isinstance(f, RepoFile)
+      ),
+      allow_patterns=snapshot_kwargs.get("allow_patterns"),
+      key=lambda f: f.path,
+    ),
+    key=lambda f: f.size,
+    reverse=True,
+  )
+  gcs_prefix = f"{CFG.gcs_hugging_face_prefix}/{repo_id}/".lstrip("/")
+  total_bytes = sum(f.size for f in repo_files)
+  logger.info(
+    f"Streaming {len(repo_files)} files ({total_bytes} bytes) of {repo_id} "
+    f"through {dest} to GCS..."
+  )
+
+  with ThreadPoolExecutor(max_workers=CFG.hf_download_workers) as downloads, \
+       ThreadPoolExecutor(max_workers=CFG.upload_workers) as uploads:
+    download_futures = {
+      downloads.submit(
+        hf_hub_download,
+        repo_id=repo_id,
+        filename=repo_file.path,
+        repo_type="dataset",
+        revision=revision,
+        local_dir=dest,
+        token=token,
+      ): repo_file
+      for repo_file in repo_files
+    }
+    upload_futures = {}
+    for f in as_completed(download_futures):
+      repo_file = download_futures[f]
+      filename = repo_file.path
+      try:
+        local_path = f.result()
+      except Exception as e:
+        logger.error(f"Failed to download {filename} from Hugging Face: {e}")
+        for pending in download_futures:
+          pending.cancel()
+        raise
+      upload_futures[uploads.submit(
+        upload_file,
+        bucket=CFG.gcs_bucket,
+        local_path=local_path,
+        gcs_path=gcs_prefix + filename,
+        upload_worker=CFG.upload_workers,
+        chunk_size_mb=CFG.chunk_size_mb,
+        size=repo_file.size,
+      )] = local_path
+
+    logger.info("Download complete")
+    # Throttled so non-TTY job logs get ~100 progress lines, not one per file
+    for f in tqdm(
+        as_completed(upload_futures), total=len(upload_futures),
+        mininterval=5.0, miniters=max(1, len(upload_futures) // 100)):
+      try:
+        f.result()
+      except Exception as e:
+        logger.error(f"Upload error for {upload_futures[f]}: {e}")
+
+  logger.info("All files uploaded to GCS.")
+  return f"{CFG.gcs_bucket}/{gcs_prefix}".rstrip("/")
 
 def download_huggingface_dataset(
   repo_id: str,
@@ -32,12 +120,13 @@ def download_huggingface_dataset(
 ) -> None:
   """
   Download a dataset from HuggingFace Hub to the specified destination directory.
-  Optionally filter by config name or split using allow_patterns.
+  Optionally filter by config name or split, and to parquet files only,
+  using allow_patterns.
   """
   # 1) Download into Filestore
 
   # Construct the base destination
-  base_dest = FILERESTORE_MOUNT_PATH
+  base_dest = CFG.filerestore_mount_path
   # Append suffix if provided
   dest = os.path.join(base_dest, dest_suffix) if dest_suffix else base_dest
   # Ensure destination directory exists
@@ -49,6 +138,9 @@ def download_huggingface_dataset(
     allow_patterns.append(f"*{config}*")
   if split:
     allow_patterns.append(f"*{split}*")
+  if parquet_only:
+    # Narrow the patterns themselves, so other files are never downloaded
+    allow_patterns = [f"{p}.parquet" for p in allow_patterns or ["*"]]
   if not allow_patterns:
     allow_patterns = None  # snapshot_download expects None or sequence
 
@@ -59,10 +151,10 @@ def download_huggingface_dataset(
     "local_dir": dest,
     # Only apply filter if provided
     **({"allow_patterns": allow_patterns} if allow_patterns is not None else {}),
-    **({"token": HF_HUB_TOKEN} if HF_HUB_TOKEN else {})
+    **({"token": CFG.hf_hub_token} if CFG.hf_hub_token else {})
   }
   parquet_status = check_datasets_server_parquet_status(
-    repo_id=repo_id, token=HF_HUB_TOKEN
+    repo_id=repo_id, token=CFG.hf_hub_token
   )
   # Use the parquet branch since the data split is better presented.
   if parquet_status['available'] and not parquet_status['is_partial']:
@@ -70,27 +162,38 @@ def download_huggingface_dataset(
 
   logger.info(f"Downloading dataset {repo_id} to {dest}...")
 
-  try:
-    snapshot_download(**snapshot_kwargs)
-  except Exception as e:
-    logger.error(f"Failed to download dataset from Hugging Face: {e}")
-    raise
-
-  logger.info("Download complete")
-
-  try:
-    gcs_dest = upload_files(
-      source=dest,
-      bucket=GCS_BUCKET,
-      repo_id=repo_id,
-      dest_prefix=GCS_HUGGING_FACE_PREFIX,
-      upload_worker=UPLOAD_WORKERS,
-      chunk_size_mb=CHUNK_SIZE_MB,
-      parquet_only=parquet_only
-    )
-  except Exception as e:
-    logger.error(f"Exception encountered while uploading to GCS: {e}")
-    raise
+  # Tar packing needs the whole file set up front, so it keeps the
+  # download-then-upload flow; otherwise uploads start as files arrive.
+  if CFG.pack_small_files:
+    try:
+      snapshot_download(**snapshot_kwargs, max_workers=CFG.hf_download_workers)
+    except Exception as e:
+      logger.error(f"Failed to download dataset from Hugging Face: {e}")
+      raise
+
+    logger.info("Download complete")
+
+    try:
+      gcs_dest = upload_files(
+        source=dest,
+        bucket=CFG.gcs_bucket,
+        repo_id=repo_id,
+        dest_prefix=CFG.gcs_hugging_face_prefix,
+        upload_worker=CFG.upload_workers,
+        chunk_size_mb=CFG.chunk_size_mb,
+        parquet_only=parquet_only,
+        pack_small_files=CFG.pack_small_files,
+        worker_type=CFG.upload_worker_type
+      )
+    except Exception as e:
+      logger.error(f"Exception encountered while uploading to GCS: {e}")
+      raise
+  else:
+    try:
+      gcs_dest = _download_and_upload(repo_id, dest, snapshot_kwargs)
+    except Exception as e:
+      logger.error(f"Exception encountered while streaming dataset to GCS: {e}")
+      raise
 
   status = publisher.publish(dataset=repo_id, destination=gcs_dest)
   if not status.is_ok():
@@ -1,26 +1,19 @@
 import os
-import sys
 import logging
 import json
+import random
 import subprocess
 import time
 from pathlib import Path
+from typing import Iterable
 
-from config import (
-  KAGGLE_KEY,
-  KAGGLE_USERNAME,
-  FILERESTORE_MOUNT_PATH,
-  GCS_KAGGLE_PREFIX,
-  GCS_BUCKET,
-  UPLOAD_WORKERS,
-  CHUNK_SIZE_MB,
-  GOOGLE_CLOUD_PROJECT,
-  PUBSUB_TOPIC,
-)
-from util.kaggle import get_all_dataset_files
+from config import CFG
+from util.kaggle import get_all_dataset_files_soa, iter_all_dataset_files
 from util.status import Status
+from util.rate_limit import TokenBucket
 from gcs.gcs_uploader import upload_files
 from kaggle.api.kaggle_api_extended import KaggleApi # type: ignore
+from kaggle.rest import RESTClientObject # type: ignore
 from tqdm import tqdm # type: ignore
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pubsub.publish import Publisher
@@ -29,24 +22,58 @@ from pubsub.publish import Publisher
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-publisher = Publisher(project=GOOGLE_CLOUD_PROJECT, topic=PUBSUB_TOPIC)
+publisher = Publisher(project=CFG.google_cloud_project, topic=CFG.pubsub_topic)
 
 _kaggle_api = None
-if KAGGLE_USERNAME and KAGGLE_KEY:
+if CFG.kaggle_username and CFG.kaggle_key:
   api = KaggleApi()
   api.authenticate()
+  # All calls already go through one urllib3 PoolManager; size its per-host
+  # pools to the download threads so no connection is discarded and
+  # re-handshaken when every thread is busy (the default is 5 per CPU).
+  api.api_client.rest_client = RESTClientObject(
+    api.api_client.configuration,
+    maxsize=max(CFG.kaggle_download_worker, api.api_client.configuration.connection_pool_maxsize),
+  )
   _kaggle_api = api
 
 
+# Shared by all download threads so requests stay under Kaggle's rate limit
+# instead of reacting to 429s after the fact.
+_kaggle_bucket = TokenBucket(
+  rate=CFG.kaggle_requests_per_second, burst=CFG.kaggle_request_burst
+)
+
+# Set once kaggle.json is known to hold the configured credentials
+_creds_written = False
+
 MAX_RETRIES = 3
 BASE_BACKOFF_SECONDS = 2
+MAX_BACKOFF_SECONDS = 30
+
+def _retry_after_seconds(e: Exception) -> float | None:
+  """
+  Return the delay requested by a Retry-After header on a Kaggle API error,
+  or None if the error carries no usable header.
+  """
+  headers = getattr(e, 'headers', None)
+  if not headers:
+    return None
+  try:
+    return float(headers.get('Retry-After'))
+  except (TypeError, ValueError):
+    return None
 
 def _ensure_kaggle_credentials():
   """
   If KAGGLE_USERNAME and KAGGLE_KEY are set in env vars,
   write them to /root/.kaggle/kaggle.json so that 'kaggle' CLI can authenticate.
+  The file is only checked on the first call in a process.
   """
-  if not KAGGLE_USERNAME or not KAGGLE_KEY:
+  global _creds_written
+  if _creds_written:
+    return
+  if not CFG.kaggle_username or not CFG.kaggle_key:
     raise ValueError('Insufficient Kaggle credentials')
 
   cred_dir = Path("/root/.kaggle")
@@ -54,19 +81,27 @@ def _ensure_kaggle_credentials():
   cred_file = cred_dir / "kaggle.json"
 
   # Only write if it doesn't exist or if contents differ
-  new_contents = {"username": KAGGLE_USERNAME, "key": KAGGLE_KEY}
+  new_contents = {"username": CFG.kaggle_username, "key": CFG.kaggle_key}
   if cred_file.exists():
     try:
       current = json.loads(cred_file.read_text())
       if current == new_contents:
+        _creds_written = True
         return
     except Exception:
         pass
 
   cred_file.write_text(json.dumps(new_contents))
   cred_file.chmod(0o600)
-
-def _download_file_worker(repo_id: str, filename: str, dest: str, kaggle_api_instance) -> Status:
+  _creds_written = True
+
+def _download_file_worker(
+  repo_id: str,
+  filename: str,
+  dest: str,
+  kaggle_api_instance,
+  force: bool = False
+) -> Status:
   """
   Worker function to download a single file from a Kaggle dataset.
   This function is designed to be executed by a thread pool executor.
@@ -76,30 +111,41 @@ def _download_file_worker(repo_id: str, filename: str, dest: str, kaggle_api_ins
     filename: The name of the file to download.
     dest: The destination directory to save the file.
     kaggle_api_instance: An instance of the Kaggle API.
+    force: Whether to re-download files that already exist in `dest`.
 
   Returns:
     Status of the download.
   """
+  sleep_time = BASE_BACKOFF_SECONDS
   for attempt in range(MAX_RETRIES):
     try:
+      _kaggle_bucket.acquire()
       # The Kaggle API client is generally thread-safe for I/O operations.
       kaggle_api_instance.dataset_download_file(
         repo_id,
         filename,
         path=dest,
-        force=False,
+        force=force,
         quiet=True,  # Suppress verbose output for each file to keep the console clean
       )
       return Status(ok=True)
     except Exception as e:
       # Check if the exception message contains '429', indicating a rate limit error.
-      if '429' in str(e):
+      if getattr(e, 'status', None) == 429 or '429' in str(e):
         if attempt < MAX_RETRIES - 1:
-          # Calculate sleep time with exponential backoff (e.g., 2, 4, 8 seconds)
-          sleep_time = BASE_BACKOFF_SECONDS * (2 ** attempt)
-          logging.warning(
-            f"Rate limit hit for '{filename}'. Retrying in {sleep_time}s... (Attempt {attempt + 2}/{MAX_RETRIES})"
+          # Decorrelated jitter keeps threads that hit the limit together
+          # from retrying in lockstep; a server-provided delay wins.
+          sleep_time = min(
+            MAX_BACKOFF_SECONDS,
+            random.uniform(BASE_BACKOFF_SECONDS, sleep_time * 3)
           )
+          retry_after = _retry_after_seconds(e)
+          if retry_after is not None:
+            sleep_time = max(sleep_time, retry_after)
+          if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+              f"Rate limit hit for '{filename}'. Retrying in {sleep_time:.1f}s... (Attempt {attempt + 2}/{MAX_RETRIES})"
+            )
           time.sleep(sleep_time)
         else:
           # Log an error if all retries fail
@@ -112,6 +158,48 @@ def _download_file_worker(repo_id: str, filename: str, dest: str, kaggle_api_ins
         logging.error(message)
         return Status(ok=False, message=message)
 
+def _download_files(
+  repo_id: str,
+  file_names: Iterable[str],
+  dest: str,
+  max_workers: int,
+  force: bool = False
+) -> int:
+  """
+  Download the given files of a Kaggle dataset into `dest` in parallel.
+  Downloads start as names are produced, so `file_names` may be a lazy
+  listing. Failures are logged per file by the worker and do not stop the
+  others; a single summary is logged at the end.
+
+  Returns:
+    The number of files submitted for download.
+  """
+  downloaded = 0
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    # Submit a download task for each file to the executor
+    futures = [
+      executor.submit(_download_file_worker, repo_id, file_name, dest, _kaggle_api, force)
+      for file_name in file_names
+    ]
+
+    # Use tqdm to create a progress bar that updates as each download completes
+    progress_bar = tqdm(
+      as_completed(futures), total=len(futures), desc=f"Downloading '{repo_id}'",
+      mininterval=5.0, miniters=max(1, len(futures) // 100)
+    )
+    
+    for future in progress_bar:
+      try:
+        # The result() call will re-raise any exceptions from the worker thread
+        status = future.result()
+        if status.is_ok():
+          downloaded += 1
+      except Exception as exc:
+        logging.error(f"An exception occurred for: {exc}")
+
+  logging.info(f"Downloaded {downloaded}/{len(futures)} files of '{repo_id}'")
+  return len(futures)
+
 def download_kaggle_dataset_concurrently(repo_id: str, dest_suffix: str, max_workers: int = 10) -> None:
   """
   Uses the Kaggle API to concurrently download all files from a dataset
@@ -127,7 +215,7 @@ def download_kaggle_dataset_concurrently(repo_id: str, dest_suffix: str, max_wor
   if _kaggle_api is None:
     raise RuntimeError("Kaggle credentials not set or Kaggle API not initialized.")
 
-  base_dest = FILERESTORE_MOUNT_PATH
+  base_dest = CFG.filerestore_mount_path
   dest = os.path.join(base_dest, dest_suffix) if dest_suffix else base_dest
 
   logging.info(f"Preparing to download Kaggle dataset '{repo_id}' to {dest}...")
@@ -138,42 +226,22 @@ def download_kaggle_dataset_concurrently(repo_id: str, dest_suffix: str, max_wor
   if not repo_id_comp or len(repo_id_comp) != 2:
     raise ValueError(f"Invalid repo_id format: '{repo_id}'. Expected 'owner/dataset'.")
 
-  try:
-    # Assumes this function returns a list of file metadata dictionaries
-    all_files = get_all_dataset_files(
-      repo_id_comp[0], repo_id_comp[1], KAGGLE_USERNAME, KAGGLE_KEY
+  # Downloads start as soon as the first page of the listing arrives
+  all_file_names = (
+    f.get('name', 'N/A') for f in iter_all_dataset_files(
+      repo_id_comp[0], repo_id_comp[1], CFG.kaggle_username, CFG.kaggle_key
     )
-    if not all_files:
-      logging.warning(f"No files found for dataset '{repo_id}'.")
-      return
-  except Exception as e:
+  )
+  try:
+    total = _download_files(repo_id, all_file_names, dest, max_workers)
+  except RuntimeError as e:
+    # Files listed before the failure have been downloaded, but the dataset
+    # is incomplete, so nothing is uploaded.
     logging.error(f"Error encountered while getting the file list: {e}")
-    raise
-
-  logging.info(f"Retrieved {len(all_files)} files in total")
-
-  logging.info("Start downloading")
-  # Use ThreadPoolExecutor to download files in parallel
-  all_file_names = [f.get('name', 'N/A') for f in all_files]
-  with ThreadPoolExecutor(max_workers=max_workers) as executor:
-    # Submit a download task for each file to the executor
-    futures = [
-      executor.submit(_download_file_worker, repo_id, file_name, dest, _kaggle_api)
-      for file_name in all_file_names
-    ]
-
-    # Use tqdm to create a progress bar that updates as each download completes
-    progress_bar = tqdm(as_completed(futures), total=len(futures), desc=f"Downloading '{repo_id}'")
-    
-    for future in progress_bar:
-      try:
-        # The result() call will re-raise any exceptions from the worker thread
-        status = future.result()
-        if not status.is_ok():
-          # The error is already logged in the worker, but you could add more handling here.
-          pass
-      except Exception as exc:
-        logging.error(f"An exception occurred for: {exc}")
+    return
+  if not total:
+    logging.warning(f"No files found for dataset '{repo_id}'.")
+    return
 
   logging.info("Kaggle concurrent download process has finished.")
 
@@ -181,11 +249,13 @@ def download_kaggle_dataset_concurrently(repo_id: str, dest_suffix: str, max_wor
     logging.info(f"Starting upload from {dest} to GCS...")
     gcs_dest = upload_files(
       source=dest,
-      bucket=GCS_BUCKET,
+      bucket=CFG.gcs_bucket,
       repo_id=repo_id,
-      dest_prefix=GCS_KAGGLE_PREFIX,
-      upload_worker=UPLOAD_WORKERS,
-      chunk_size_mb=CHUNK_SIZE_MB
+      dest_prefix=CFG.gcs_kaggle_prefix,
+      upload_worker=CFG.upload_workers,
+      chunk_size_mb=CFG.chunk_size_mb,
+      pack_small_files=CFG.pack_small_files,
+      worker_type=CFG.upload_worker_type
     )
     logging.info("Upload to GCS complete.")
   except Exception as e:
@@ -204,7 +274,7 @@ def download_kaggle_dataset(repo_id: str, dest_suffix: str) -> None:
   if _kaggle_api is None:
     raise RuntimeError("Kaggle credentials not set or Kaggle API not initialized.")
 
-  base_dest = FILERESTORE_MOUNT_PATH
+  base_dest = CFG.filerestore_mount_path
   dest = os.path.join(base_dest, dest_suffix) if dest_suffix else base_dest
 
   logging.info(f"Downloading Kaggle dataset '{repo_id}' to {dest}...")
@@ -216,36 +286,38 @@ def download_kaggle_dataset(repo_id: str, dest_suffix: str) -> None:
     raise ValueError(f'Invalid repo_id {repo_id}')
 
   try:
-    all_files = get_all_dataset_files(
-      repo_id_comp[0], repo_id_comp[1], KAGGLE_USERNAME, KAGGLE_KEY)
+    listing = get_all_dataset_files_soa(
+      repo_id_comp[0], repo_id_comp[1], CFG.kaggle_username, CFG.kaggle_key)
+    if listing is None:
+      raise RuntimeError(f"Could not list files of '{repo_id}'")
   except Exception as e:
     logging.error(f"Error {e} encountered while getting full file list.")
     raise e
 
-  for f in tqdm(all_files):
-    filename = f.get('name', 'N/A')
-    try:
-      _kaggle_api.dataset_download_file(
-        repo_id,
-        filename,
-        path=dest,
-        force=True,
-        quiet=False,
-      )
-    except Exception as e:
-      logging.error(f"Exception encountered {e}")
-      continue
+  # Largest files first, so the longest downloads are not left for last;
+  # files of unknown size (-1) go at the end.
+  names, sizes = listing["name"], listing["totalBytes"]
+  order = sorted(range(len(names)), key=sizes.__getitem__, reverse=True)
+  _download_files(
+    repo_id,
+    [names[i] for i in order],
+    dest,
+    CFG.kaggle_download_worker,
+    force=True,
+  )
 
   logging.info("Kaggle download complete.")
 
   try:
     upload_files(
       source=dest,
-      bucket=GCS_BUCKET,
+      bucket=CFG.gcs_bucket,
       repo_id=repo_id,
-      dest_prefix=GCS_KAGGLE_PREFIX,
-      upload_worker=UPLOAD_WORKERS,
-      chunk_size_mb=CHUNK_SIZE_MB
+      dest_prefix=CFG.gcs_kaggle_prefix,
+      upload_worker=CFG.upload_workers,
+      chunk_size_mb=CFG.chunk_size_mb,
+      pack_small_files=CFG.pack_small_files,
+      worker_type=CFG.upload_worker_type
     )
   except Exception as e:
     logger.error(f"Exception encountered while uploading to GCS: {e}")
@@ -261,7 +333,7 @@ def download_kaggle_dataset_with_cli(repo_id: str, dest_suffix: str) -> None:
     logging.error(f'Exception encountered while setting up local Kaggle credentials {e}')
     raise
 
-  base_dest = FILERESTORE_MOUNT_PATH
+  base_dest = CFG.filerestore_mount_path
   dest = os.path.join(base_dest, dest_suffix) if dest_suffix else base_dest
 
   logging.info(f"Downloading Kaggle dataset '{repo_id}' to {dest} via CLI…")
@@ -275,10 +347,10 @@ def download_kaggle_dataset_with_cli(repo_id: str, dest_suffix: str) -> None:
     repo_id,
     "-p", dest,
   ]
-  # Run Kaggle CLI; it will show a progress bar on stdout/stderr
+  # Run Kaggle CLI; it inherits our stdout/stderr and writes its progress bar
+  # there directly, so no pipe can fill up and stall the download.
   try:
-    with subprocess.Popen(cmd, stdout=sys.stdout, stderr=sys.stderr) as proc:
-      proc.communicate()
+    subprocess.run(cmd, check=True)
     logging.info("Kaggle download completed.")
   except subprocess.CalledProcessError as e:
     raise RuntimeError(f"Kaggle CLI failed: {e}") from e
@@ -287,11 +359,13 @@ def download_kaggle_dataset_with_cli(repo_id: str, dest_suffix: str) -> None:
   try:
     gcs_dest = upload_files(
       source=dest,
-      bucket=GCS_BUCKET,
+      bucket=CFG.gcs_bucket,
       repo_id=repo_id,
-      dest_prefix=GCS_KAGGLE_PREFIX,
-      upload_worker=UPLOAD_WORKERS,
-      chunk_size_mb=CHUNK_SIZE_MB
+      dest_prefix=CFG.gcs_kaggle_prefix,
+      upload_worker=CFG.upload_workers,
+      chunk_size_mb=CFG.chunk_size_mb,
+      pack_small_files=CFG.pack_small_files,
+      worker_type=CFG.upload_worker_type
     )
   except Exception as e:
     logger.error(f"Exception encountered while uploading to GCS: {e}")
@@ -1,9 +1,6 @@
 import argparse
-from distutils.util import strtobool
 
-from hf_downloader import download_huggingface_dataset
-from kaggle_downloader import download_kaggle_dataset_concurrently
-from config import KAGGLE_DOWNLOAD_WORKER
+from config import CFG
 
 def main():
   parser = argparse.ArgumentParser(
@@ -31,12 +28,15 @@ def main():
   parser.add_argument(
     "--parquet_only",
     help="Whether to download parquet format files only",
-    type=lambda x: bool(strtobool(x)),
+    action=argparse.BooleanOptionalAction,
     default=False
-)
+  )
   args = parser.parse_args()
 
+  # Downloaders are imported on demand, so a job only initializes the
+  # client of the source it downloads from.
   if args.source == 'huggingface':
+    from hf_downloader import download_huggingface_dataset, publisher
     download_huggingface_dataset(
       repo_id=args.dataset,
       config=args.config,
@@ -45,14 +45,21 @@ def main():
       parquet_only=args.parquet_only
     )
   elif args.source == 'kaggle':
+    from kaggle_downloader import download_kaggle_dataset_concurrently, publisher
     download_kaggle_dataset_concurrently(
       repo_id=args.dataset,
       dest_suffix=args.dest_suffix,
-      max_workers=KAGGLE_DOWNLOAD_WORKER,
+      max_workers=CFG.kaggle_download_worker,
     )
   else:
     raise ValueError(f"Unknown source '{args.source}'")
 
+  # Confirm the completion message was delivered while the interpreter can
+  # still start the client's publishing threads, and fail the job if not.
+  status = publisher.flush()
+  if not status.is_ok():
+    raise RuntimeError(status.message)
+
 
 if __name__ == "__main__":
   main()
\ No newline at end of file